@@ -418,6 +418,9 @@ def parse_all_cached_files(scrape_jobs, session, scraper_search):
             if num_cached % 200 == 0:
                 session.commit()
 
+            # the links of the serp are written to the database when it is flushed,
+            # store_serp_result() reads them from there.
+            session.flush()
             store_serp_result(serp)
             num_cached += 1
             scrape_jobs.remove(job)
@@ -10,7 +10,8 @@ import pickle
 import queue
 from random import shuffle
 from GoogleScraper.commandline import get_command_line
-from GoogleScraper.database import ScraperSearch, SERP, Link, Proxy, SearchEngine, SearchEngineProxyStatus, get_session, fixtures, generate_id
+from GoogleScraper.database import ScraperSearch, SERP, Link, Domain, Proxy, SearchEngine, SearchEngineProxyStatus, get_session, \
+    fixtures
 from GoogleScraper.proxies import tuples_to_proxies, parse_proxy_file, get_proxies_from_mysql_db, add_proxies_to_db
 from GoogleScraper.caching import fix_broken_cache_names, _caching_is_one_to_one, parse_all_cached_files, \
     clean_cachefiles
@@ -354,7 +355,6 @@ def main(return_results=False, parse_cmd_line=True):
 
     if not scraper_search:
         scraper_search = ScraperSearch(
-            id=generate_id(),
             keyword_file=os.path.abspath(kwfile),
             number_search_engines_used=num_search_engines,
             number_proxies_used=len(proxies),
@@ -477,7 +477,7 @@ def main(return_results=False, parse_cmd_line=True):
     else:
         print("Saving data to S3...")
 
-    table_objs = [ScraperSearch, SERP, Link, Proxy, SearchEngine, SearchEngineProxyStatus]
+    table_objs = [ScraperSearch, SERP, Link, Domain, Proxy, SearchEngine, SearchEngineProxyStatus]
     s3writers = [ s3.S3Table(to,
                              Config['SCRAPE_INFOS'].get('scrape_id'),
                              Config['ENV'],
@@ -505,6 +505,7 @@ class SERPLog:
         self.catalog[keyword] = serp
 
     def write_to_s3(self):
-        conn = s3.get_s3_conn(Config['ENV'])
         for k, s in self.catalog.items():
-            s3.store_serp_in_s3(s, self.scrape_id, k, Config['ENV'], conn)
+            s3.store_serp_in_s3(s, self.scrape_id, k, Config['ENV'])
+        # the uploads run in the background, re-raises the error of a failed one
+        s3.wait_for_uploads()
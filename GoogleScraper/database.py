@@ -3,24 +3,29 @@
 """
 The database schema of GoogleScraper.
 
-There are four entities:
+There are five entities:
 
     ScraperSearch: Represents a call to GoogleScraper. A search job.
     SearchEngineResultsPage: Represents a SERP result page of a search_engine
     Link: Represents a LINK on a SERP
+    Domain: The domain of a LINK, shared by all links on the same domain
     Proxy: Stores all proxies and their statuses.
 
 Because searches repeat themselves and we avoid doing them again (caching), one SERP page
 can be assigned to more than one ScraperSearch. Therefore we need a n:m relationship.
 """
 
-import datetime
+import os
+from functools import lru_cache
+from itertools import repeat
 from GoogleScraper.config import Config
 from urllib.parse import urlparse
 from sqlalchemy import Column, String, Integer, ForeignKey, Table, DateTime, Enum, Boolean
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref
-from sqlalchemy import create_engine, UniqueConstraint
+from sqlalchemy.orm import relationship, selectinload, Session
+from sqlalchemy.sql import func
+from sqlalchemy import create_engine, inspect, select, UniqueConstraint, Index, event
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 import sqlite3
@@ -29,48 +34,107 @@ from uuid import uuid4
 
 Base = declarative_base()
 
-generate_id = lambda: str(uuid4())
+# Integer primary keys are only unique within one database. The uuid columns
+# identify rows across scrapes, for example after the upload to S3.
+generate_id = lambda: uuid4().hex
+
+
+def generate_ids(n):
+    """Return n random ids, drawn from the os with a single urandom() call."""
+    buf = os.urandom(16 * n)
+    return [buf[i * 16:(i + 1) * 16].hex() for i in range(n)]
+
+
+# Characters that make a netloc too irregular to be sliced out of the url by hand.
+_NETLOC_SPECIAL_CHARS = frozenset(':@?#[]\t\r\n ')
+
+
+@lru_cache(maxsize=8192)
+def _netloc_cached(url):
+    return urlparse(url).netloc
+
+
+def _netloc(url):
+    """Return urlparse(url).netloc.
+
+    The common scheme://host/path case is sliced out directly, anything
+    else (ports, credentials, missing scheme, ...) goes through urlparse.
+    """
+    if isinstance(url, str):
+        scheme, sep, rest = url.partition('://')
+        if sep and scheme.isalpha():
+            netloc = rest.partition('/')[0]
+            if not _NETLOC_SPECIAL_CHARS.intersection(netloc):
+                return netloc
+    return _netloc_cached(url)
+
+
+# The column lengths of the link texts. Longer titles and snippets are cut off before
+# the insert, the urls are stored as they are.
+TITLE_MAX_LENGTH = 512
+SNIPPET_MAX_LENGTH = 1024
+
+
+def _truncate(value, length):
+    if isinstance(value, str):
+        return value[:length]
+    return value
+
+
+# The maximal number of links that are sent to the database in one executemany.
+LINK_INSERT_CHUNK = 1000
+
+# Issued on every new sqlite connection.
+SQLITE_PRAGMAS = (
+    'page_size=32768',
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'cache_size=-65536',
+    'mmap_size=268435456',
+    'temp_store=MEMORY',
+)
 
 scraper_searches_serps = Table('scraper_searches_serps', Base.metadata,
-                               Column('scraper_search_id', String, ForeignKey('scraper_search.id')),
-                               Column('serp_id', String, ForeignKey('serp.id')))
+                               Column('scraper_search_id', Integer, ForeignKey('scraper_search.id')),
+                               Column('serp_id', Integer, ForeignKey('serp.id')))
 
 
 class ScraperSearch(Base):
     __tablename__ = 'scraper_search'
 
-    id = Column(String, primary_key=True, autoincrement=False)
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(32), unique=True, default=generate_id)
     keyword_file = Column(String)
     number_search_engines_used = Column(Integer)
     used_search_engines = Column(String)
     number_proxies_used = Column(Integer)
     number_search_queries = Column(Integer)
-    started_searching = Column(DateTime, default=datetime.datetime.utcnow)
+    started_searching = Column(DateTime, server_default=func.current_timestamp())
     stopped_searching = Column(DateTime)
 
     serps = relationship(
         'SearchEngineResultsPage',
         secondary=scraper_searches_serps,
-        backref=backref('scraper_searches', uselist=True)
+        back_populates='scraper_searches'
     )
 
     def __str__(self):
-        return '<ScraperSearch[{id}] scraped for {number_search_queries} unique keywords. Started scraping: {started_' \
-               'searching} and stopped: {stopped_searching}>'.format(**self.__dict__)
+        return f'<ScraperSearch[{self.id}] scraped for {self.number_search_queries} unique keywords. ' \
+               f'Started scraping: {self.started_searching} and stopped: {self.stopped_searching}>'
 
-    def __repr__(self):
-        return self.__str__()
+    __repr__ = __str__
 
 
 class SearchEngineResultsPage(Base):
     __tablename__ = 'serp'
 
-    id = Column(String, primary_key=True, autoincrement=False)
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(32), unique=True, default=generate_id)
     status = Column(String, default='successful')
     search_engine_name = Column(String)
     scrape_method = Column(String)
     page_number = Column(Integer)
-    requested_at = Column(DateTime, default=datetime.datetime.utcnow)
+    requested_at = Column(DateTime, server_default=func.current_timestamp())
     requested_by = Column(String, default='127.0.0.1')
 
     # The string in the SERP that indicates how many results we got for the search term.
@@ -94,12 +158,18 @@ class SearchEngineResultsPage(Base):
     # If no_results is true, then there weren't ANY RESULTS FOUND FOR THIS QUERY!!!
     no_results = Column(Boolean, default=False)
 
+    scraper_searches = relationship(
+        ScraperSearch,
+        secondary=scraper_searches_serps,
+        back_populates='serps'
+    )
+
+    links = relationship('Link', back_populates='serp')
+
     def __str__(self):
-        return '<SERP[{search_engine_name}] has [{num_results}] link results for query "{query}">'.format(
-            **self.__dict__)
+        return f'<SERP[{self.search_engine_name}] has [{self.num_results}] link results for query "{self.query}">'
 
-    def __repr__(self):
-        return self.__str__()
+    __repr__ = __str__
 
     def _strip_delimiter(self, value):
         # Delimiter (stripped here) should be kept in conf? Used by Ravana also. -dmatysiak
@@ -129,37 +199,54 @@ class SearchEngineResultsPage(Base):
         self.effective_query = str(parser.effective_query)
         self.no_results = parser.no_results
 
+        scrape_infos = Config['SCRAPE_INFOS']
+        scrape_id = scrape_infos.get('scrape_id')
+        project_id = scrape_infos.get('project_id')
+        device = scrape_infos.get('device')
+        strip_delimiter = self._strip_delimiter
+        strip_protocol = self._strip_protocol
+
+        # The links are not instantiated as ORM objects, but collected column by
+        # column and inserted with a single executemany when the SERP itself is
+        # flushed. See _insert_links() below.
+        link_uuids = iter(generate_ids(sum(len(value) for value in parser.search_results.values()
+                                         if isinstance(value, list))))
+        columns = tuple([] for _ in range(_LINK_PARSER_COLUMNS))
+        (uuids, links, snippets, titles, visible_links, actual_links, users, profile_urls,
+         ranks, link_types, prices, stores) = columns
+        domains = []
+        # The same url may be found by several result types (an ad and an organic
+        # result for example), but is stored only once per serp.
+        seen_links = set()
         for key, value in parser.search_results.items():
             if isinstance(value, list):
                 for link in value:
-                    # fill with nones to prevent key errors
-                    [link.update({key: None}) for key in ('snippet', 'title', 'visible_link', 'price', 'store', 'device') if key not in link]
-
-                    visibility_link = self._strip_protocol(self._strip_delimiter(link.get('visible_link')))
-                    actual_link = self._strip_protocol(self._strip_delimiter(link.get('link')))
+                    url = strip_delimiter(link.get('link'))
+                    if url in seen_links:
+                        continue
+                    seen_links.add(url)
 
-                    domain = urlparse(link['visible_link']).netloc
+                    domain = _netloc(link.get('visible_link'))
                     if not domain:
-                        domain = urlparse(link['link']).netloc
-                    Link(
-                        id=generate_id(),
-                        link=self._strip_delimiter(link.get('link')),
-                        snippet=self._strip_delimiter(link.get('snippet')),
-                        title=self._strip_delimiter(link.get('title')),
-                        visible_link=visibility_link,
-                        actual_link=actual_link,
-                        user=link.get('user'),
-                        profile_url=link.get('profile_url'),
-                        domain=domain,
-                        rank=link.get('rank'),
-                        link_type=key,
-                        scrape_id=Config['SCRAPE_INFOS'].get('scrape_id'),
-                        project_id=Config['SCRAPE_INFOS'].get('project_id'),
-                        serp=self,
-                        price=link.get('price'),
-                        store=link.get('store'),
-                        device=Config['SCRAPE_INFOS'].get('device'),
-                    )
+                        domain = _netloc(link.get('link'))
+
+                    uuids.append(next(link_uuids))
+                    links.append(url)
+                    snippets.append(_truncate(strip_delimiter(link.get('snippet')), SNIPPET_MAX_LENGTH))
+                    titles.append(_truncate(strip_delimiter(link.get('title')), TITLE_MAX_LENGTH))
+                    visible_links.append(strip_protocol(strip_delimiter(link.get('visible_link'))))
+                    actual_links.append(strip_protocol(url))
+                    users.append(link.get('user'))
+                    profile_urls.append(link.get('profile_url'))
+                    ranks.append(link.get('rank'))
+                    link_types.append(key)
+                    prices.append(link.get('price'))
+                    stores.append(link.get('store'))
+                    domains.append(domain)
+
+        self._link_columns = columns
+        self._link_domains = domains
+        self._link_scrape_infos = (scrape_id, project_id, device)
 
     def set_values_from_scraper(self, scraper):
         """Populate itself from a scraper object.
@@ -173,7 +260,6 @@ class SearchEngineResultsPage(Base):
         Args:
             A scraper object.
         """
-        self.id = generate_id()
         self.query = scraper.query
         self.search_engine_name = scraper.search_engine_name
         self.scrape_method = scraper.scrape_method
@@ -190,14 +276,30 @@ class SearchEngineResultsPage(Base):
 SERP = SearchEngineResultsPage
 
 
+class Domain(Base):
+    """The netloc of links. Stored once and referenced by all links with that domain."""
+
+    __tablename__ = 'domain'
+
+    id = Column(Integer, primary_key=True)
+    netloc = Column(String(255), unique=True, index=True)
+
+    def __str__(self):
+        return self.netloc
+
+    def __repr__(self):
+        return f'<Domain {self.netloc}>'
+
+
 class Link(Base):
     __tablename__ = 'link'
 
-    id = Column(String, primary_key=True, autoincrement=False)
-    title = Column(String(1024))
-    snippet = Column(String(1024))
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(32), unique=True, default=generate_id)
+    title = Column(String(TITLE_MAX_LENGTH))
+    snippet = Column(String(SNIPPET_MAX_LENGTH))
     link = Column(String(4096))
-    domain = Column(String(1024))
+    domain_id = Column(Integer, ForeignKey('domain.id'), index=True)
     visible_link = Column(String(2048))
     actual_link = Column(String(4096))
     rank = Column(Integer)
@@ -206,27 +308,135 @@ class Link(Base):
     profile_url = Column(String(1024))
     scrape_id = Column(String)
     project_id = Column(String)
-    scrape_time = Column(DateTime, default=datetime.datetime.utcnow)
+    scrape_time = Column(DateTime, server_default=func.current_timestamp())
+
+    serp_id = Column(Integer, ForeignKey('serp.id'))
+
+    # Copied from the serp on insert, so exports don't need to join the serp table.
+    search_engine_name = Column(String, index=True)
+    query = Column(String(1024))
+    requested_at = Column(DateTime)
 
-    serp_id = Column(String, ForeignKey('serp.id'))
     store = Column(String(64))
     price = Column(String(64))
     device = Column(Integer)
 
-    serp = relationship(SearchEngineResultsPage, backref=backref('links', uselist=True))
+    serp = relationship(SearchEngineResultsPage, back_populates='links')
+    domain = relationship(Domain, lazy='joined')
+
+    __table_args__ = (
+        Index('ix_link_serp_rank', 'serp_id', 'rank'),
+        Index('ux_link_serp_link', 'serp_id', 'link', unique=True),
+    )
 
     def __str__(self):
-        return '<Link at rank {rank} has url: {link}>'.format(**self.__dict__)
+        return f'<Link at rank {self.rank} has url: {self.link}>'
 
-    def __repr__(self):
-        return self.__str__()
+    __repr__ = __str__
+
+
+# The links are inserted with positional parameters in this column order.
+_LINK_COLUMNS = (
+    # collected for each link by SearchEngineResultsPage.set_values_from_parser()
+    'uuid', 'link', 'snippet', 'title', 'visible_link', 'actual_link', 'user', 'profile_url',
+    'rank', 'link_type', 'price', 'store',
+    # resolved from the netloc when the links are inserted
+    'domain_id',
+    # the same for all links of a serp, scrape_time is filled in by sqlite
+    'scrape_id', 'project_id', 'device', 'serp_id', 'search_engine_name', 'query', 'requested_at',
+)
+_LINK_PARSER_COLUMNS = _LINK_COLUMNS.index('domain_id')
+
+_LINK_INSERT = 'INSERT OR IGNORE INTO link ({columns}) VALUES ({params})'.format(
+    columns=', '.join(map(sqlite.dialect().identifier_preparer.quote, _LINK_COLUMNS)),
+    params=', '.join('?' * len(_LINK_COLUMNS)))
+
+# The domain insert is built once and its compiled form is cached,
+# instead of being compiled again for every serp.
+_DOMAIN_INSERT = Domain.__table__.insert().prefix_with('OR IGNORE')
+_compiled_cache = {}
+
+
+def _get_domain_ids(connection, netlocs):
+    """Map the netlocs to the ids of their domain rows, creating missing domains.
+
+    The ids are cached on the dbapi connection until the next rollback, so known domains
+    aren't queried again.
+    """
+    domain_ids = connection.info.setdefault('domain_ids', {})
+    missing = [netloc for netloc in netlocs if netloc not in domain_ids]
+    if missing:
+        domain = Domain.__table__
+        connection.execution_options(compiled_cache=_compiled_cache).execute(
+            _DOMAIN_INSERT, [{'netloc': netloc} for netloc in missing])
+        domain_ids.update(
+            (netloc, domain_id) for domain_id, netloc in
+            connection.execute(select([domain.c.id, domain.c.netloc]).where(domain.c.netloc.in_(missing)))
+        )
+    return domain_ids
+
+
+@event.listens_for(SearchEngineResultsPage, 'after_insert')
+def _insert_links(mapper, connection, serp):
+    """Insert the links collected by SearchEngineResultsPage.set_values_from_parser().
+
+    The serp id (and the values set by set_values_from_scraper()) are only final once
+    the serp is inserted, so the links are written from here with one executemany
+    in the same transaction.
+    """
+    columns = getattr(serp, '_link_columns', None)
+    if columns and columns[0]:
+        domain_ids = _get_domain_ids(connection, {domain for domain in serp._link_domains if domain})
+        serp_values = serp._link_scrape_infos + (
+            serp.id, serp.search_engine_name, serp.query, serp.requested_at)
+        rows = list(zip(*columns,
+                        [domain_ids.get(domain) for domain in serp._link_domains],
+                        *map(repeat, serp_values)))
+        for i in range(0, len(rows), LINK_INSERT_CHUNK):
+            connection.execute(_LINK_INSERT, rows[i:i + LINK_INSERT_CHUNK])
+
+
+@event.listens_for(Session, 'after_flush')
+def _remember_new_serps(session, flush_context):
+    new_serps = [obj for obj in session.new if isinstance(obj, SearchEngineResultsPage)]
+    session.info['new_serps'] = new_serps
+    session.info.setdefault('uncommitted_serps', []).extend(new_serps)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_committed_links(session):
+    """Drop the links collected by set_values_from_parser() once they are committed.
+
+    Until then they are kept, a serp that is added again after a rollback is stored
+    with its links.
+    """
+    for serp in session.info.pop('uncommitted_serps', ()):
+        if inspect(serp).persistent:
+            serp._link_columns = serp._link_domains = None
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_uncommitted_serps(session):
+    session.info.pop('uncommitted_serps', None)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_links_of_new_serps(session, flush_context):
+    """Reload serp.links of the serps inserted by the flush on the next access.
+
+    The collection was either never loaded or loaded empty while the serp was pending,
+    the links themselves are written by _insert_links() without the ORM.
+    """
+    for serp in session.info.pop('new_serps', ()):
+        session.expire(serp, ['links'])
 
 
 class Proxy(Base):
     __tablename__ = 'proxy'
 
-    id = Column(String, primary_key=True, autoincrement=False)
-    ip = Column(String)
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(32), unique=True, default=generate_id)
+    ip = Column(String, index=True)
     hostname = Column(String)
     port = Column(Integer)
     proto = Column(String), #Enum('socks5', 'socks4', 'http'))
@@ -236,7 +446,7 @@ class Proxy(Base):
     online = Column(Boolean)
     status = Column(String)
     checked_at = Column(DateTime)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.current_timestamp())
 
     city = Column(String)
     region = Column(String)
@@ -245,13 +455,14 @@ class Proxy(Base):
     org = Column(String)
     postal = Column(String)
 
-    #UniqueConstraint(ip, port, name='unique_proxy')
+    __table_args__ = (
+        UniqueConstraint('ip', 'port', name='unique_proxy'),
+    )
 
     def __str__(self):
-        return '<Proxy {ip}>'.format(**self.__dict__)
+        return f'<Proxy {self.ip}>'
 
-    def __repr__(self):
-        return self.__str__()
+    __repr__ = __str__
 
 
 db_Proxy = Proxy
@@ -260,8 +471,9 @@ db_Proxy = Proxy
 class SearchEngine(Base):
     __tablename__ = 'search_engine'
     
-    id = Column(String, primary_key=True, autoincrement=False)
-    name = Column(String, unique=False)
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(32), unique=True, default=generate_id)
+    name = Column(String, index=True)
     http_url = Column(String)
     selenium_url = Column(String)
     image_url = Column(String)
@@ -275,9 +487,10 @@ class SearchEngineProxyStatus(Base):
 
     __tablename__ = 'search_engine_proxy_status'
     
-    id = Column(String, primary_key=True, autoincrement=False)
-    proxy_id = Column(String, ForeignKey('proxy.id'))
-    search_engine_id = Column(String, ForeignKey('search_engine.id'))
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(32), unique=True, default=generate_id)
+    proxy_id = Column(Integer, ForeignKey('proxy.id'))
+    search_engine_id = Column(Integer, ForeignKey('search_engine.id'))
     available = Column(Boolean)
     last_check = Column(DateTime)
 
@@ -286,17 +499,56 @@ def get_engine(path=None):
     """Return the sqlalchemy engine.
 
     Args:
-        path: The path/name of the database to create/read from.
+        path: The path/name of the database to create/read from. Defaults to the
+            database_path option. If neither is set, a shared in-memory database is used.
 
     Returns:
         The sqlalchemy engine.
     """
     echo = True if (Config['GLOBAL'].getint('verbosity', 0) >= 4) else False
-    creator = lambda: sqlite3.connect('file::memory:?cache=shared&echo={0}'.format(echo),
-                                      uri=True,
-                                      check_same_thread=False)
+    path = path or Config['GLOBAL'].get('database_path', '')
+    # isolation_level=None stops the sqlite3 module from opening and committing
+    # transactions on its own, the transactions are started in begin_before_write() below.
+    if path:
+        creator = lambda: sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    else:
+        creator = lambda: sqlite3.connect('file::memory:?cache=shared&echo={0}'.format(echo),
+                                          uri=True,
+                                          check_same_thread=False,
+                                          isolation_level=None)
 
     engine = create_engine('sqlite://', creator=creator)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # page_size must be set before the database is created and is
+        # ignored afterwards, journal_mode=WAL is a no-op on memory databases.
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute('PRAGMA {}'.format(pragma))
+        cursor.close()
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def begin_before_write(connection, cursor, statement, parameters, context, executemany):
+        # A deferred BEGIN before the first statement of a transaction that isn't a read.
+        # The reads run in autocommit: an open read transaction on the shared cache
+        # in-memory database keeps its table locks until the session commits, which
+        # makes the writes of the other threads fail. The sessions of one thread share
+        # that connection, the transaction of some other session may already be open on it.
+        if connection.in_transaction() and not cursor.connection.in_transaction \
+                and not statement.startswith('SELECT'):
+            cursor.connection.execute('BEGIN')
+
+    @event.listens_for(engine, 'rollback')
+    @event.listens_for(engine, 'rollback_savepoint')
+    def forget_domain_ids(connection, *args):
+        # The cached ids of the domains inserted by the transaction don't exist anymore.
+        connection.info.pop('domain_ids', None)
+
+    @event.listens_for(engine, 'close')
+    def optimize_sqlite(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA optimize')
+
     Base.metadata.create_all(engine)
 
     return engine
@@ -319,13 +571,55 @@ def get_session(scoped=False, engine=None, path=None):
         return session_factory
 
 
+def iter_links_core(session, serp_id):
+    """Iterate over the links of a serp without loading Link objects.
+
+    This is the recommended way to read links in bulk, for example when exporting
+    results. The rows are plain tuples of (link, rank, domain) and skip the
+    identity map and attribute instrumentation of the ORM. Use the Link objects
+    only when links need to be modified.
+
+    Args:
+        session: A database session to work with.
+        serp_id: The id of the serp to get the links for.
+
+    Returns:
+        The result rows, ordered by rank.
+    """
+    link = Link.__table__
+    domain = Domain.__table__
+    return session.execute(
+        select([link.c.link, link.c.rank, domain.c.netloc.label('domain')])
+        .select_from(link.outerjoin(domain))
+        .where(link.c.serp_id == serp_id)
+        .order_by(link.c.rank)
+    )
+
+
+def load_scraper_search(session, scraper_search_id):
+    """Load a scraper search together with all its serps and their links.
+
+    This is the canonical way to fetch a finished search. The serps and links
+    are loaded with one extra query each, no matter how many serps there are.
+
+    Args:
+        session: A database session to work with.
+        scraper_search_id: The id of the scraper search.
+
+    Returns:
+        The ScraperSearch object.
+    """
+    return session.query(ScraperSearch).options(
+        selectinload(ScraperSearch.serps).selectinload(SearchEngineResultsPage.links)
+    ).filter(ScraperSearch.id == scraper_search_id).one()
+
+
 def fixtures(session):
     """Add some base data."""
 
-    for se in Config['SCRAPING'].get('supported_search_engines', '').split(','):
-        if se:
-            search_engine = session.query(SearchEngine).filter(SearchEngine.name == se).first()
-            if not search_engine:
-                session.add(SearchEngine(id=generate_id(), name=se))
+    # a name that is given twice is stored once
+    names = list(dict.fromkeys(se for se in Config['SCRAPING'].get('supported_search_engines', '').split(',') if se))
+    existing = {name for name, in session.query(SearchEngine.name).filter(SearchEngine.name.in_(names))}
+    session.bulk_save_objects([SearchEngine(name=name) for name in names if name not in existing])
 
     session.commit()
@@ -303,7 +303,8 @@ class HttpScrape(SearchEngineScrape, threading.Timer):
                                         proxies=proxies)
             
             self.requested_at = datetime.datetime.utcnow()
-            self.html = request.text
+            # the parser decodes the raw body itself
+            self.html = request.content
 
             self.serp_log.add(self.query, self.html)
             
@@ -16,7 +16,7 @@ impossible to launch lang scrape jobs with millions of keywords.
 
 output_format = 'stdout'
 outfile = None
-csv_fieldnames = set(Link.__table__.columns._data.keys() + SERP.__table__.columns._data.keys()) - {'id', 'serp_id'}
+csv_fieldnames = set(Link.__table__.columns._data.keys() + SERP.__table__.columns._data.keys() + ['domain']) - {'id', 'uuid', 'serp_id', 'domain_id'}
 
 
 class JsonStreamWriter():
@@ -87,7 +87,7 @@ def store_serp_result(serp):
         data = row2dict(serp)
         data['results'] = []
         for link in serp.links:
-            data['results'].append(row2dict(link))
+            data['results'].append(link2dict(link))
 
         if output_format == 'json':
             # The problem here is, that we need to stream write the json data.
@@ -111,3 +111,10 @@ def row2dict(obj):
         d[column.name] = str(getattr(obj, column.name))
 
     return d
+
+
+def link2dict(link):
+    """Convert a Link object to dictionary, with the domain resolved to its netloc."""
+    d = row2dict(link)
+    d['domain'] = str(link.domain)
+    return d
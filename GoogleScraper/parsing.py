@@ -3,12 +3,17 @@
 import sys
 import os
 import re
+import lxml.etree
 import lxml.html
 from lxml.html.clean import Cleaner
 import logging
-from urllib.parse import unquote
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import unquote, urlsplit
 import pprint
-from GoogleScraper.database import SearchEngineResultsPage, generate_id
+from GoogleScraper.database import SearchEngineResultsPage
 from GoogleScraper.config import Config
 from GoogleScraper.log import out
 from cssselect import HTMLTranslator
@@ -17,6 +22,93 @@ from datadog import initialize, api
 
 logger = logging.getLogger('GoogleScraper')
 
+_TRANSLATOR = HTMLTranslator()
+
+
+@lru_cache(maxsize=1024)
+def _css_to_xpath(css):
+    """Translate a css selector (without pseudo elements) to xpath."""
+    return _TRANSLATOR.css_to_xpath(css)
+
+
+_dd_initialized = False
+
+
+def _ensure_dd_initialized():
+    """Configure the datadog api the first time a metric is sent."""
+    global _dd_initialized
+    if not _dd_initialized:
+        initialize(**dict(Config['DATADOG_KEYS']))
+        _dd_initialized = True
+
+
+def _extract_rows(results, fields):
+    """Return the values of every result element as a dict.
+
+    Args:
+        results: The result elements.
+        fields: The (key, xpath, extractor) triples of the values, see Parser._compile_selectors().
+    """
+    return [{key: extract(xpath(result)) for key, xpath, extract in fields} for result in results]
+
+
+# The keys of a selector set that select the result elements, the other keys select their values.
+_CONTAINER_KEYS = ('container', 'result_container', '_xpath')
+
+# lxml parsers must not be shared between threads, every scraper thread gets its own.
+_thread_local = threading.local()
+
+
+def _html_parser():
+    """Return the html parser of the current thread.
+
+    The parser doesn't build the id index (nothing calls get_element_by_id())
+    and drops comments. Whitespace only text is kept, it separates the words
+    of the extracted titles and snippets.
+    """
+    try:
+        return _thread_local.html_parser
+    except AttributeError:
+        parser = _thread_local.html_parser = lxml.html.HTMLParser(encoding='utf-8', collect_ids=False,
+                                                                  remove_comments=True)
+        return parser
+
+
+def _text_of_first(nodes):
+    return nodes[0].text_content() if nodes else None
+
+
+def _attr_of_first(attr):
+    def extract(nodes):
+        return nodes[0].get(attr) if nodes else None
+    return extract
+
+
+def _raw_query_param(url, name):
+    """Return the still percent-encoded value of the parameter name in the query of url.
+
+    Unlike parse_qs(), a + in the value is left as it is.
+    """
+    for param in urlsplit(url).query.split('&'):
+        key, _, value = param.partition('=')
+        if key == name:
+            return value
+    return None
+
+
+# Extract the target url of the redirect links on google serp pages, by search type.
+_CLEAN_RE = {
+    'normal': re.compile(r'/url\?q=(?P<url>.*?)&sa=U&ei='),
+    'image': re.compile(r'imgres\?imgurl=(?P<url>.*?)&'),
+}
+
+# Strips scripts, comments and styles from the html of cached serp pages.
+_CLEANER = Cleaner(scripts=True, javascript=True, comments=True, style=True)
+
+# The messages of google serp pages without any results, for raw and decoded html.
+_NO_RESULTS = re.compile(rb'No results found for|did not match any documents')
+_NO_RESULTS_TEXT = re.compile(_NO_RESULTS.pattern.decode())
+
 
 class InvalidSearchTypeException(Exception):
     pass
@@ -62,6 +154,9 @@ class Parser():
     # some search engine show on which page we currently are. If supportd, this selector will get this value.
     page_number_selectors = []
 
+    # The name of the search engine, to be set by the implementing sub classes
+    search_engine = ''
+
     # The supported search types. For instance, Google supports Video Search, Image Search, News search
     search_types = []
 
@@ -72,21 +167,124 @@ class Parser():
     # Any of these attributes represent css selectors for a specific search type.
     # If you didn't specify the search type in the search_types list, this attribute
     # will not be evaluated and no data will be parsed.
+    # Instead of the css selectors 'container' and 'result_container', a selector set
+    # may give the xpath expression of its result elements as '_xpath'.
+
+    # Parsers are created for every serp page, so they don't carry an instance dict.
+    # Subclasses declare empty __slots__ to keep it that way.
+    __slots__ = ('searchtype', 'query', 'html', 'dom', 'search_results', 'num_results_for_query',
+                 'num_results', 'effective_query', 'page_number', 'no_results', 'no_results_text')
+
+    # The css selectors compiled to lxml XPath objects, keyed by the css selector.
+    _xpath_cache = {}
+
+    # The compiled selectors of the search types, see _compile_selectors().
+    _compiled_search_selectors = {}
+
+    def __init_subclass__(cls, **kwargs):
+        """Compile the selectors of every parser once, when the parser class is created."""
+        super().__init_subclass__(**kwargs)
+        cls._compile_selectors()
+
+    @classmethod
+    def _compile_selectors(cls):
+        """Compile all selectors of the parser class.
+
+        The selectors of a search type are stored in _compiled_search_selectors as
+        {attr_name: {result_type: [(selector_specific, container xpath, [(key, xpath, extractor), ...]), ...]}}
+        """
+        cls._compiled_search_selectors = {}
+
+        for name in dir(cls):
+            if name.startswith('_') or not name.endswith(('_selector', '_selectors')):
+                continue
+            value = getattr(cls, name)
+            if isinstance(value, list):
+                cls._first_match_extractors(value)
+            elif isinstance(value, dict):
+                cls._compiled_search_selectors[name] = {
+                    result_type: [
+                        (selector_specific,
+                         cls._container_xpath(selectors),
+                         [(key,) + cls._extractor(selector) for key, selector in selectors.items()
+                          if key not in _CONTAINER_KEYS])
+                        for selector_specific, selectors in selector_class.items()
+                    ]
+                    for result_type, selector_class in value.items()
+                }
+
+    @classmethod
+    def _compiled(cls, css):
+        """Return the css selector compiled to a lxml XPath object."""
+        try:
+            return cls._xpath_cache[css]
+        except KeyError:
+            xpath = cls._xpath_cache[css] = lxml.etree.XPath(_css_to_xpath(css))
+            return xpath
+
+    # The compiled xpath and the value extracting function of the selectors, keyed by the selector.
+    _extractor_cache = {}
+
+    @classmethod
+    def _extractor(cls, selector):
+        """Return the compiled xpath of a selector and a function that extracts the value from its matches.
+
+        The pseudo elements ::text and ::attr(attribute) are evaluated by the extracting function.
+        """
+        try:
+            return cls._extractor_cache[selector]
+        except KeyError:
+            pass
+
+        attr_start = selector.find('::attr(')
+        if attr_start != -1 and selector.endswith(')'):
+            extract = _attr_of_first(selector[attr_start + len('::attr('):-1])
+        else:
+            extract = _text_of_first
+
+        entry = cls._extractor_cache[selector] = (cls._compiled(selector.split('::')[0]), extract)
+        return entry
+
+    # The extractors of the selector lists given to first_match(), keyed by the selectors.
+    _first_match_cache = {}
+
+    @classmethod
+    def _first_match_extractors(cls, selectors):
+        """Return the extractors of the non empty selectors, see _extractor()."""
+        key = tuple(selectors)
+        try:
+            return cls._first_match_cache[key]
+        except KeyError:
+            extractors = cls._first_match_cache[key] = [cls._extractor(selector) for selector in selectors if selector]
+            return extractors
+
+    @classmethod
+    def _container_xpath(cls, selectors):
+        """Return the compiled xpath of the result elements of a selector set."""
+        if '_xpath' in selectors:
+            return lxml.etree.XPath(selectors['_xpath'])
+        return cls._compiled(cls._container_css(selectors))
+
+    @staticmethod
+    def _container_css(selectors):
+        """Return the css selector of the result elements of a selector set."""
+        if 'result_container' in selectors and selectors['result_container']:
+            return '{container} {result_container}'.format(**selectors)
+        return selectors['container']
 
     def __init__(self, html=None, query=''):
         """Create new Parser instance and parse all information.
 
         Args:
             html: The raw html from the search engine search. If not provided, you can parse 
-                    the data later by calling parse(html) directly.
+                    the data later by calling parse(html) directly. Preferably the undecoded
+                    utf-8 bytes of the response, they are handed to lxml as they are.
             searchtype: The search type. By default "normal"
             
         Raises:
             Assertion error if the subclassed
             specific parser cannot handle the the settings.
         """
-        initialize(**dict(Config['DATADOG_KEYS']))
-        
         self.searchtype = Config['SCRAPING'].get('search_type', 'normal')
         assert self.searchtype in self.search_types, 'search type "{}" is not supported in {}'.format(
             self.searchtype,
@@ -103,12 +301,6 @@ class Parser():
         self.page_number = -1
         self.no_results = False
 
-        # to be set by the implementing sub classes
-        self.search_engine = ''
-
-        # short alias because we use it so extensively
-        self.css_to_xpath = HTMLTranslator().css_to_xpath
-
         if self.html:
             self.parse()
 
@@ -116,13 +308,12 @@ class Parser():
         """Public function to start parsing the search engine results.
         
         Args: 
-            html: The raw html data to extract the SERP entries from.
+            html: The raw html data to extract the SERP entries from, as bytes or str.
         """
         if html:
             self.html = html
 
         # lets do the actual parsing
-        print("Parsing the SERP for {keyword}...".format(keyword=self.query))
         self._parse()
 
         # Apply subclass specific behaviour after parsing has happened
@@ -132,23 +323,19 @@ class Parser():
 
     def _parse_lxml(self, cleaner=None):
         try:
-            parser = lxml.html.HTMLParser(encoding='utf-8')
             if cleaner:
                 self.dom = cleaner.clean_html(self.dom)
-            self.dom = lxml.html.document_fromstring(self.html, parser=parser)
-            self.dom.resolve_base_href()
+            self.dom = lxml.html.document_fromstring(self.html, parser=_html_parser())
         except Exception as e:
             # maybe wrong encoding
             logger.error(e)
 
     def _parse(self, cleaner=None):
-        print("SERP for {keyword} length = {htmllen}".format(
-            keyword=self.query,
-            htmllen=len(self.html)))
         """Internal parse the dom according to the provided css selectors.
         
         Raises: InvalidSearchTypeException if no css selectors for the searchtype could be found.
         """
+        logger.debug('SERP for %s length = %d', self.query, len(self.html))
         self._parse_lxml(cleaner)
 
         # Try to parse the number of results
@@ -185,90 +372,70 @@ class Parser():
         #
         # Where it allll happens...
         #
-        for result_type, selector_class in selector_dict.items():
+        for result_type, compiled_selectors in self._compiled_search_selectors[attr_name].items():
             
             self.search_results[result_type] = []
-            
-            for selector_specific, selectors in selector_class.items():
-                
-                if 'result_container' in selectors and selectors['result_container']:
-                    css = '{container} {result_container}'.format(**selectors)
-                else:
-                    css = selectors['container']
-
-                results = self.dom.xpath(
-                    self.css_to_xpath(css) # This is where the css selection is compiled to xpath.
-                )
-
-                print("* Scraping {result_type} variation {selector_specific} [{results} results]...".format(
-                    result_type=result_type,
-                    selector_specific=selector_specific,
-                    results=len(results)))
-                
-                to_extract = set(selectors.keys()) - {'container', 'result_container'}
-                selectors_to_use = {key: selectors[key] for key in to_extract if key in selectors.keys()}
+            # The position of every link in self.search_results[result_type]
+            # and the links that were found without a visible link so far.
+            seen_links = {}
+            missing_vlink = set()
+
+            # fields are the compiled selectors of the result values, see _compile_selectors()
+            for selector_specific, container_xpath, fields in compiled_selectors:
                 
+                results = container_xpath(self.dom)
+
+                logger.debug('* Scraping %s variation %s [%d results]...', result_type, selector_specific, len(results))
+
                 current_rank = 1
-                for result in results:
-                    # Let's add primitive support for CSS3 pseudo selectors
-                    # We just need two of them
-                    # ::text
-                    # ::attr(attribute)
-
-                    # You say we should use xpath expressions instead?
-                    # Maybe you're right, but they are complicated when it comes to classes,
-                    # have a look here: http://doc.scrapy.org/en/latest/topics/selectors.html
-                    serp_result = {}
-                    # key are for example 'link', 'snippet', 'visible-url', ...
-                    # selector is the selector to grab these items
-                    for key, selector in selectors_to_use.items():
-                        serp_result[key] = self.advanced_css(selector, result)
+                # Let's add primitive support for CSS3 pseudo selectors
+                # We just need two of them
+                # ::text
+                # ::attr(attribute)
+
+                # You say we should use xpath expressions instead?
+                # Maybe you're right, but they are complicated when it comes to classes,
+                # have a look here: http://doc.scrapy.org/en/latest/topics/selectors.html
+                # key are for example 'link', 'snippet', 'visible-url', ...
+                for serp_result in _extract_rows(results, fields):
 
                     # Only add when link is not None and no
                     # duplicates. If a duplicate result does exist but
                     # have a visible link that was missing previously,
                     # replace old one.
-                    print("\t- {rank}. {visible_link}".format(
-                        rank=current_rank,
-                        visible_link=serp_result.get('visible_link')))
-                    if 'link' in serp_result and serp_result['link'] and \
-                       not [ e for e in self.search_results[result_type] if e['link'] == serp_result['link'] ]:
+                    logger.debug('\t- %d. %s', current_rank, serp_result.get('visible_link'))
+                    link = serp_result.get('link')
+                    if link and link not in seen_links:
+                        seen_links[link] = len(self.search_results[result_type])
+                        if serp_result.get('visible_link', False) is None:
+                            missing_vlink.add(link)
                         self.search_results[result_type].append(serp_result)
                         serp_result['rank'] = current_rank
-                        print("\t  [NEWLINK] {visible_link}".format(
-                            visible_link=serp_result.get('visible_link')))
+                        logger.debug('\t  [NEWLINK] %s', serp_result.get('visible_link'))
                         current_rank += 1
                         self.num_results += 1
-                    elif 'link' in serp_result and serp_result['link'] and \
-                         'visible_link' in serp_result and serp_result['visible_link']:
-
-                        vlinks = [ e for e in self.search_results[result_type] if e['link'] == serp_result['link']
-                                   and e['visible_link'] is None ]
-                        
-                        if vlinks:
-                            vl = vlinks[0] # should only be one
-                            print("WARNING: {n_vlinks} matches [{vlinks}]".format(
-                                n_vlinks=len(vlinks),
-                                vlinks=", ".join(map(str, [ e['visible_link'] for e in vlinks ]))))
-                            
-                            serp_result['rank'] = vl['rank']
-                            vl_index = self.search_results[result_type].index(vl)
-                            print("\t  [REPLACE] ({rank}. {old_vlink})".format(
-                                rank=serp_result['rank'],
-                                old_vlink=self.search_results[result_type][vl_index]))
-                            self.search_results[result_type][vl_index] = serp_result
-
-
-        for restype, res in self.search_results.items():
-            api.Metric.send(metric="l2wr.{rt}".format(rt=restype),
-                            points=len(res),
-                            tags=[#"keyword:{kw}".format(kw=self.query),
-                                "search_engine:{se}".format(se=Config['SCRAPING']['search_engines']),
-                                "env:{e}".format(e=Config['GLOBAL']['env_name']),
-                                "scrape_id:{s}".format(s=Config['SCRAPE_INFOS']['scrape_id']),
-                                "project_id:{p}".format(p=Config['SCRAPE_INFOS']['project_id']),
-                                "device:{d}".format(d=Config['SCRAPE_INFOS']['device'])])
-
+                    elif link and serp_result.get('visible_link') and link in missing_vlink:
+                        missing_vlink.discard(link)
+                        vl_index = seen_links[link]
+                        serp_result['rank'] = self.search_results[result_type][vl_index]['rank']
+                        logger.debug('\t  [REPLACE] (%d. %s)', serp_result['rank'],
+                                     self.search_results[result_type][vl_index])
+                        self.search_results[result_type][vl_index] = serp_result
+
+
+        # Report the number of results of every result type in a single request.
+        scrape_infos = Config['SCRAPE_INFOS']
+        tags = [#"keyword:{kw}".format(kw=self.query),
+                "search_engine:{se}".format(se=Config['SCRAPING']['search_engines']),
+                "env:{e}".format(e=Config['GLOBAL']['env_name']),
+                "scrape_id:{s}".format(s=scrape_infos['scrape_id']),
+                "project_id:{p}".format(p=scrape_infos['project_id']),
+                "device:{d}".format(d=scrape_infos['device'])]
+        metrics = [{'metric': "l2wr.{rt}".format(rt=restype), 'points': len(res), 'tags': tags}
+                   for restype, res in self.search_results.items()]
+        if metrics:
+            _ensure_dd_initialized()
+            api.Metric.send(metrics=metrics)
 
     def advanced_css(self, selector, element):
         """Evaluate the :text and ::attr(attr-name) additionally.
@@ -281,29 +448,8 @@ class Parser():
             The targeted element.
 
         """
-        value = None
-
-        if selector.endswith('::text'):
-            try:
-                value = element.xpath(self.css_to_xpath(selector.split('::')[0]))[0].text_content()
-            except IndexError:
-                pass
-        else:
-            match = re.search(r'::attr\((?P<attr>.*)\)$', selector)
-
-            if match:
-                attr = match.group('attr')
-                try:
-                    value = element.xpath(self.css_to_xpath(selector.split('::')[0]))[0].get(attr)
-                except IndexError:
-                    pass
-            else:
-                try:
-                    value = element.xpath(self.css_to_xpath(selector))[0].text_content()
-                except IndexError:
-                    pass
-
-        return value
+        xpath, extract = self._extractor(selector)
+        return extract(xpath(element))
 
     def first_match(self, selectors, element):
         """Get the first match.
@@ -317,14 +463,10 @@ class Parser():
         """
         assert isinstance(selectors, list), 'selectors must be of type list!'
 
-        for selector in selectors:
-            if selector:
-                try:
-                    match = self.advanced_css(selector, element=element)
-                    if match:
-                        return match
-                except IndexError as e:
-                    pass
+        for xpath, extract in self._first_match_extractors(selectors):
+            match = extract(xpath(element))
+            if match:
+                return match
 
         return False
 
@@ -332,7 +474,16 @@ class Parser():
         """Subclass specific behaviour after parsing happened.
         
         Override in subclass to add search engine specific behaviour.
-        Commonly used to clean the results.
+        Commonly used to find out whether the page has results for the query.
+        Pages with results are cleaned afterwards in clean_results().
+        """
+        if self.num_results:
+            self.clean_results()
+
+    def clean_results(self):
+        """Override in subclass to clean the results, commonly the urls.
+
+        Only called for pages with results.
         """
 
     def __str__(self):
@@ -341,16 +492,10 @@ class Parser():
 
     @property
     def cleaned_html(self):
-        # Try to parse the provided HTML string using lxml
-        # strip all unnecessary information to save space
-        cleaner = Cleaner()
-        cleaner.scripts = True
-        cleaner.javascript = True
-        cleaner.comments = True
-        cleaner.style = True
-        self.dom = cleaner.clean_html(self.dom)
+        # strip all unnecessary information from the parsed dom to save space.
+        # clean_html() works on a copy, self.dom stays usable.
         assert len(self.dom), 'The html needs to be parsed to get the cleaned html'
-        return lxml.html.tostring(self.dom)
+        return lxml.html.tostring(_CLEANER.clean_html(self.dom))
 
     def iter_serp_items(self):
         """Yields the key and index of any item in the serp results that has a link value"""
@@ -361,6 +506,35 @@ class Parser():
                     if isinstance(item, dict) and item['link']:
                         yield (key, i)
 
+    def drop_serp_items(self, items):
+        """Removes the serp items with the given (key, index) pairs, as yielded by iter_serp_items().
+
+        The result lists are rebuilt once instead of deleting from them while iterating.
+        """
+        for key in {key for key, i in items}:
+            self.search_results[key] = [item for i, item in enumerate(self.search_results[key])
+                                        if (key, i) not in items]
+
+    def search_links(self, pattern):
+        """Yields every serp item whose link matches pattern, together with the first match.
+
+        The links are joined by newlines and scanned in one finditer() pass, so
+        the pattern must not match a newline.
+        """
+        items = [self.search_results[key][i] for key, i in self.iter_serp_items()]
+        starts = []
+        offset = 0
+        for item in items:
+            starts.append(offset)
+            offset += len(item['link']) + 1
+
+        last = -1
+        for match in pattern.finditer('\n'.join(item['link'] for item in items)):
+            index = bisect_right(starts, match.start()) - 1
+            if index != last:
+                last = index
+                yield items[index], match
+
 
 """
 Here follow the different classes that provide CSS selectors 
@@ -391,6 +565,8 @@ it very easy to grab all data the site has to offer.
 class GoogleParser(Parser):
     """Parses SERP pages of the Google search engine."""
 
+    __slots__ = ()
+
     search_engine = 'google'
 
     search_types = ['normal', 'image']
@@ -492,15 +668,6 @@ class GoogleParser(Parser):
         super().__init__(*args, **kwargs)
 
     def after_parsing(self):
-        """Clean the urls.
-        
-        A typical scraped results looks like the following:
-        
-        '/url?q=http://www.youtube.com/user/Apple&sa=U&ei=\
-        lntiVN7JDsTfPZCMgKAO&ved=0CFQQFjAO&usg=AFQjCNGkX65O-hKLmyq1FX9HQqbb9iYn9A'
-        
-        Clean with a short regex.
-        """
         super().after_parsing()
         
         if self.searchtype == 'normal':
@@ -509,48 +676,50 @@ class GoogleParser(Parser):
             elif self.num_results <= 0:
                 self.no_results = True
 
-            if 'No results found for' in str(self.html) or 'did not match any documents' in str(self.html):
+            no_results = _NO_RESULTS if isinstance(self.html, bytes) else _NO_RESULTS_TEXT
+            if no_results.search(self.html) is not None:
                 self.no_results = True
 
             # finally try in the snippets
             if self.no_results is True:
                 for key, i in self.iter_serp_items():
-
-                    if 'snippet' in self.search_results[key][i] and self.query:
-                        if self.query.replace('"', '') in self.search_results[key][i]['snippet']:
+                    item = self.search_results[key][i]
+                    if 'snippet' in item and self.query:
+                        if self.query.replace('"', '') in item['snippet']:
                             self.no_results = False
 
-        clean_regexes = {
-            'normal': r'/url\?q=(?P<url>.*?)&sa=U&ei=',
-            'image': r'imgres\?imgurl=(?P<url>.*?)&'
-        }
+    def clean_results(self):
+        """Clean the urls.
+        
+        A typical scraped results looks like the following:
+        
+        '/url?q=http://www.youtube.com/user/Apple&sa=U&ei=\
+        lntiVN7JDsTfPZCMgKAO&ved=0CFQQFjAO&usg=AFQjCNGkX65O-hKLmyq1FX9HQqbb9iYn9A'
+        
+        Clean with a short regex.
+        """
+        clean_regex = _CLEAN_RE[self.searchtype]
 
         for key, i in self.iter_serp_items():
-            result = re.search(
-                clean_regexes[self.searchtype],
-                self.search_results[key][i]['link']
-            )
+            item = self.search_results[key][i]
+            result = clean_regex.search(item['link'])
             if result:
-                self.search_results[key][i]['link'] = unquote(result.group('url'))
+                item['link'] = unquote(result.group('url'))
 
-            actual_link = self.search_results[key][i]['link']
-            if actual_link:
-                if not re.match('http', actual_link):
-                    actual_link = 'http://' + actual_link
-
-            visible_link = self.search_results[key][i].get('visible_link')
+            visible_link = item.get('visible_link')
             if visible_link:
-                vlink = str.strip(visible_link)
-                try:
-                    vlink = vlink.split()[0]
-                except:
-                    pass
-                self.search_results[key][i]['visible_link'] = 'http://' + vlink 
+                # keep only the first word of the visible url
+                vlink = visible_link.split(None, 1)
+                item['visible_link'] = 'http://' + (vlink[0] if vlink else '')
 
 
 class BaiduParser(Parser):
     """Parses SERP pages of the Baidu search engine."""
 
+    __slots__ = ()
+
+    _XP_HIT_TOP_NEW = lxml.etree.XPath(_css_to_xpath('.hit_top_new'))
+
     search_engine = 'baidu'
 
     search_types = ['normal', 'image']
@@ -756,36 +925,38 @@ class BaiduParser(Parser):
 
         # Extract the domain from the visible link since Baidu always
         # redirects through its own domain.
+        drop = set()
         for key, i in self.iter_serp_items():
+            item = self.search_results[key][i]
             # HTML hard to pin down for now. Just delete incorrectly scraped elements. 
-            if not any([self.search_results[key][i]['title'],
-                        self.search_results[key][i]['snippet'],
-                        self.search_results[key][i]['visible_link']]):
-                del self.search_results[key][i]
+            if not (item['title'] or item['snippet'] or item['visible_link']):
+                drop.add((key, i))
                 continue
 
-            visible_link = self.search_results[key][i].get('visible_link')
+            visible_link = item.get('visible_link')
             if visible_link:
-                vlink = str.strip(visible_link)
-                try:
-                    vlink = vlink.split()[0]
-                except:
-                    pass
-                self.search_results[key][i]['visible_link'] = 'http://' + vlink
-                self.search_results[key][i]['link'] = self.search_results[key][i]['visible_link']
-                        
+                # keep only the first word of the visible url
+                vlink = visible_link.split(None, 1)
+                item['visible_link'] = item['link'] = 'http://' + (vlink[0] if vlink else '')
+
+        self.drop_serp_items(drop)
+
         if self.search_engine == 'normal':
-            if len(self.dom.xpath(self.css_to_xpath('.hit_top_new'))) >= 1:
+            if len(self._XP_HIT_TOP_NEW(self.dom)) >= 1:
                 self.no_results = True
 
-            for key, i in self.iter_serp_items():
-                if self.search_results[key][i]['visible_link'] is None:
-                    del self.search_results[key][i]
+            self.drop_serp_items({(key, i) for key, i in self.iter_serp_items()
+                                  if self.search_results[key][i]['visible_link'] is None})
 
                 
 class YandexParser(Parser):
     """Parses SERP pages of the Yandex search engine."""
 
+    __slots__ = ()
+
+    # The image url is either in the json object of onmousedown or in the img_url parameter of href.
+    _IMG_URL_RE = re.compile(r'\{"href"[^\S\n]*:[^\S\n]*"(?P<href>.*?)"\}|img_url=(?P<imgurl>.*?)&')
+
     search_engine = 'yandex'
 
     search_types = ['normal', 'image']
@@ -830,6 +1001,18 @@ class YandexParser(Parser):
         super().__init__(*args, **kwargs)
 
     def after_parsing(self):
+        super().after_parsing()
+
+        if self.searchtype == 'normal':
+            self.no_results = False
+
+            if self.no_results_text:
+                self.no_results = 'По вашему запросу ничего не нашлось' in self.no_results_text
+
+            if self.num_results == 0:
+                self.no_results = True
+
+    def clean_results(self):
         """Clean the urls.
 
         Normally Yandex image search store the image url in the onmousedown attribute in a json object. Its
@@ -843,32 +1026,19 @@ class YandexParser(Parser):
         href="/images/search?text=snow&img_url=\
         http%3A%2F%2Fwww.proza.ru%2Fpics%2F2009%2F12%2F07%2F1290.jpg&pos=2&rpt=simage&pin=1">
         """
-        super().after_parsing()
-
-        if self.searchtype == 'normal':
-            self.no_results = False
-
-            if self.no_results_text:
-                self.no_results = 'По вашему запросу ничего не нашлось' in self.no_results_text
-
-            if self.num_results == 0:
-                self.no_results = True
-
         if self.searchtype == 'image':
-            for key, i in self.iter_serp_items():
-                for regex in (
-                        r'\{"href"\s*:\s*"(?P<url>.*?)"\}',
-                        r'img_url=(?P<url>.*?)&'
-                ):
-                    result = re.search(regex, self.search_results[key][i]['link'])
-                    if result:
-                        self.search_results[key][i]['link'] = result.group('url')
-                        break
+            for item, result in self.search_links(self._IMG_URL_RE):
+                item['link'] = result.group('href') or result.group('imgurl')
 
 
 class BingParser(Parser):
     """Parses SERP pages of the Bing search engine."""
 
+    __slots__ = ()
+
+    # The image url in the links of image search results.
+    _IMG_URL_RE = re.compile(r'imgurl:"(?P<url>.*?)"')
+
     search_engine = 'bing'
 
     search_types = ['normal', 'image']
@@ -941,14 +1111,6 @@ class BingParser(Parser):
         super().__init__(*args, **kwargs)
 
     def after_parsing(self):
-        """Clean the urls.
-
-        The image url data is in the m attribute.
-
-        m={ns:"images.1_4",k:"5018",mid:"46CE8A1D71B04B408784F0219B488A5AE91F972E",
-        surl:"http://berlin-germany.ca/",imgurl:"http://berlin-germany.ca/images/berlin250.jpg",
-        oh:"184",tft:"45",oi:"http://berlin-germany.ca/images/berlin250.jpg"}
-        """
         super().after_parsing()
 
         if self.searchtype == 'normal':
@@ -958,20 +1120,27 @@ class BingParser(Parser):
                 self.no_results = self.query in self.no_results_text \
                     or 'Do you want results only for' in self.no_results_text
 
+    def clean_results(self):
+        """Clean the urls.
+
+        The image url data is in the m attribute.
+
+        m={ns:"images.1_4",k:"5018",mid:"46CE8A1D71B04B408784F0219B488A5AE91F972E",
+        surl:"http://berlin-germany.ca/",imgurl:"http://berlin-germany.ca/images/berlin250.jpg",
+        oh:"184",tft:"45",oi:"http://berlin-germany.ca/images/berlin250.jpg"}
+        """
         if self.searchtype == 'image':
-            for key, i in self.iter_serp_items():
-                for regex in (
-                        r'imgurl:"(?P<url>.*?)"',
-                ):
-                    result = re.search(regex, self.search_results[key][i]['link'])
-                    if result:
-                        self.search_results[key][i]['link'] = result.group('url')
-                        break
+            for item, result in self.search_links(self._IMG_URL_RE):
+                item['link'] = result.group('url')
 
 
 class YahooParser(Parser):
     """Parses SERP pages of the Yahoo search engine."""
 
+    __slots__ = ()
+
+    _XP_CQUERY = lxml.etree.XPath(_css_to_xpath('#cquery'))
+
     search_engine = 'yahoo'
 
     search_types = ['normal', 'image']
@@ -1012,6 +1181,18 @@ class YahooParser(Parser):
         super().__init__(*args, **kwargs)
 
     def after_parsing(self):
+        super().after_parsing()
+
+        if self.searchtype == 'normal':
+
+            self.no_results = False
+            if self.num_results == 0:
+                self.no_results = True
+
+            if len(self._XP_CQUERY(self.dom)) >= 1:
+                self.no_results = True
+
+    def clean_results(self):
         """Clean the urls.
 
         The url is in the href attribute and the &imgurl= parameter.
@@ -1028,36 +1209,26 @@ class YahooParser(Parser):
         sigr=11j056ue0&sigb=134sbn4gc&sigi=11df3qlvm&sigt=10pd8j49h&sign=10pd8j49h&.crumb=qAIpMoHvtm1&\
         fr=yfp-t-901&fr2=piv-web">
         """
-        super().after_parsing()
-
         if self.searchtype == 'normal':
-
-            self.no_results = False
-            if self.num_results == 0:
-                self.no_results = True
-
-            if len(self.dom.xpath(self.css_to_xpath('#cquery'))) >= 1:
-                self.no_results = True
-
-            for key, i in self.iter_serp_items():
-                if self.search_results[key][i]['visible_link'] is None:
-                    del self.search_results[key][i]
+            self.drop_serp_items({(key, i) for key, i in self.iter_serp_items()
+                                  if self.search_results[key][i]['visible_link'] is None})
 
         if self.searchtype == 'image':
             for key, i in self.iter_serp_items():
-                for regex in (
-                        r'&imgurl=(?P<url>.*?)&',
-                ):
-                    result = re.search(regex, self.search_results[key][i]['link'])
-                    if result:
-                        # TODO: Fix this manual protocol adding by parsing "rurl"
-                        self.search_results[key][i]['link'] = 'http://' + unquote(result.group('url'))
-                        break
+                item = self.search_results[key][i]
+                imgurl = _raw_query_param(item['link'], 'imgurl')
+                if imgurl:
+                    # TODO: Fix this manual protocol adding by parsing "rurl"
+                    item['link'] = 'http://' + unquote(imgurl)
                 
 
 class DuckduckgoParser(Parser):
     """Parses SERP pages of the Duckduckgo search engine."""
 
+    __slots__ = ()
+
+    _XP_NO_RESULTS = lxml.etree.XPath(_css_to_xpath('.no-results'))
+
     search_engine = 'duckduckgo'
 
     search_types = ['normal']
@@ -1093,7 +1264,7 @@ class DuckduckgoParser(Parser):
         if self.searchtype == 'normal':
 
             try:
-                if 'No more results.' in self.dom.xpath(self.css_to_xpath('.no-results'))[0].text_content():
+                if 'No more results.' in self._XP_NO_RESULTS(self.dom)[0].text_content():
                     self.no_results = True
             except:
                 pass
@@ -1107,6 +1278,8 @@ class DuckduckgoParser(Parser):
 class AskParser(Parser):
     """Parses SERP pages of the Ask search engine."""
 
+    __slots__ = ()
+
     search_engine = 'ask'
 
     search_types = ['normal']
@@ -1136,6 +1309,8 @@ class AskParser(Parser):
 class BlekkoParser(Parser):
     """Parses SERP pages of the Blekko search engine."""
 
+    __slots__ = ()
+
     search_engine = 'blekko'
 
     search_types = ['normal']
@@ -1162,6 +1337,8 @@ class BlekkoParser(Parser):
 class YouTubeParser(Parser):
     """Parses SERP pages of the YouTube search engine :D."""
 
+    __slots__ = ()
+
     search_engine = 'youtube'
 
     search_types = ['normal']
@@ -1200,6 +1377,8 @@ class YouTubeParser(Parser):
 class YouTubeSponsoredParser(Parser):
     """Parses SERP pages of the YouTube (sponsored) search engine :D."""
 
+    __slots__ = ()
+
     search_engine = 'youtube_sponsored'
 
     search_types = ['normal']
@@ -1225,6 +1404,31 @@ class YouTubeSponsoredParser(Parser):
     }
 
     
+# One alternation over the url prefixes of all search engines, the name of the group that
+# matched tells the parser.
+_URL_DISPATCH_RE = re.compile(r'^(?:'
+                              r'http[s]?://www\.(?P<google>google)'
+                              r'|http://(?P<yandex>yandex\.ru)'
+                              r'|http://www\.(?P<bing>bing\.)'
+                              r'|http[s]?://(?P<yahoo>search\.yahoo.)'
+                              r'|http://www\.(?P<baidu>baidu\.com)'
+                              r'|https://(?P<duckduckgo>duckduckgo\.com)'
+                              r'|http[s]?://[a-z]{2}?\.(?P<ask>ask)'
+                              r'|http[s]?://(?P<blekko>blekko)'
+                              r')')
+
+_URL_PARSERS = {
+    'google': GoogleParser,
+    'yandex': YandexParser,
+    'bing': BingParser,
+    'yahoo': YahooParser,
+    'baidu': BaiduParser,
+    'duckduckgo': DuckduckgoParser,
+    'ask': AskParser,
+    'blekko': BlekkoParser,
+}
+
+
 def get_parser_by_url(url):
     """Get the appropriate parser by an search engine url.
 
@@ -1237,37 +1441,30 @@ def get_parser_by_url(url):
     Raises:
         UnknowUrlException if no parser could be found for the url.
     """
-    parser = None
-
-    if re.search(r'^http[s]?://www\.google', url):
-        parser = GoogleParser
-    elif re.search(r'^http://yandex\.ru', url):
-        parser = YandexParser
-    elif re.search(r'^http://www\.bing\.', url):
-        parser = BingParser
-    elif re.search(r'^http[s]?://search\.yahoo.', url):
-        parser = YahooParser
-    elif re.search(r'^http://www\.baidu\.com', url):
-        parser = BaiduParser
-    elif re.search(r'^https://duckduckgo\.com', url):
-        parser = DuckduckgoParser
-    if re.search(r'^http[s]?://[a-z]{2}?\.ask', url):
-        parser = AskParser
-    if re.search(r'^http[s]?://blekko', url):
-        parser = BlekkoParser
-    #if re.search(r'^http[s]?://www\.youtube', url):
-    #    parser = YouTubeParser
-    if not parser:
+    match = _URL_DISPATCH_RE.search(url)
+    if not match:
         raise UnknowUrlException('No parser for {}.'.format(url))
 
-    return parser
-
-def is_this_search_engine(search_engine, matching_search_engines):
-    """A predicate meant to centralize all search engine token
-    comparisons.
+    return _URL_PARSERS[match.lastgroup]
 
-    """
-    return search_engine.lower() in map(lambda s: s.lower(), matching_search_engines)
+_ENGINE_PARSERS = {
+    'google': GoogleParser,
+    'googleimg': GoogleParser,
+    'baidu': BaiduParser,
+    'baiduimg': BaiduParser,
+    # The following entries ought be expunged vigorously and with
+    # great flourish. The exception may be Yandex, but the Russia team
+    # has become mysteriously quiet, even absent. Perhaps His
+    # Excellency Putin was displeased...
+    'yandex': YandexParser,
+    'bing': BingParser,
+    'yahoo': YahooParser,
+    'duckduckgo': DuckduckgoParser,
+    'ask': AskParser,
+    'blekko': BlekkoParser,
+    'youtube': YouTubeParser,
+    'youtube_sponsored': YouTubeSponsoredParser,
+}
 
 def get_parser_by_search_engine(search_engine):
     """Get the appropriate parser for the search_engine
@@ -1281,34 +1478,32 @@ def get_parser_by_search_engine(search_engine):
     Raises:
         NoParserForSearchEngineException if no parser could be found for the name.
     """
-    if is_this_search_engine(search_engine, ['google', 'googleimg']):
-        return GoogleParser
-    elif search_engine == 'baidu' or search_engine == 'baiduimg':
-        return BaiduParser
-    # The following branches ought be expunged vigorously and with
-    # great flourish. The exception may be Yandex, but the Russia team
-    # has become mysteriously quiet, even absent. Perhaps His
-    # Excellency Putin was displeased...
-    elif is_this_search_engine(search_engine, ['yandex']):
-        return YandexParser
-    elif is_this_search_engine(search_engine, ['bing']):
-        return BingParser
-    elif is_this_search_engine(search_engine, ['yahoo']):
-        return YahooParser
-    elif is_this_search_engine(search_engine, ['duckduckgo']):
-        return DuckduckgoParser
-    elif is_this_search_engine(search_engine, ['ask']):
-        return AskParser
-    elif is_this_search_engine(search_engine, ['blekko']):
-        return BlekkoParser
-    elif is_this_search_engine(search_engine, ['youtube']):
-        return YouTubeParser
-    elif is_this_search_engine(search_engine, ['youtube_sponsored']):
-        return YouTubeSponsoredParser
-    else:
+    try:
+        return _ENGINE_PARSERS[search_engine.lower()]
+    except KeyError:
         raise NoParserForSearchEngineException('No such parser for {}'.format(search_engine))
 
     
+def parse_many(parser_cls, html_list, queries, max_workers=None):
+    """Parse several serp pages of one search engine concurrently.
+
+    The pages are parsed in a pool of threads, lxml releases the GIL while it
+    parses the html. The compiled selectors are shared by all threads and lxml
+    evaluates every XPath object under a lock, so only the html parsing overlaps.
+
+    Args:
+        parser_cls: The Parser subclass of the search engine.
+        html_list: The raw html of the serp pages.
+        queries: The query of every serp page, in the order of html_list.
+        max_workers: The number of threads, by default the number of cpus.
+
+    Returns:
+        The parsers of the serp pages, in the order of html_list.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        return list(executor.map(lambda html, query: parser_cls(html=html, query=query), html_list, queries))
+
+
 def parse_serp(html=None, parser=None, scraper=None, search_engine=None, query=''):
     """Store the parsed data in the sqlalchemy session.
 
@@ -1332,8 +1527,6 @@ def parse_serp(html=None, parser=None, scraper=None, search_engine=None, query='
 
     serp = SearchEngineResultsPage()
 
-    serp.id = generate_id()
-    
     if query:
         serp.query = query
 
@@ -1345,6 +1538,9 @@ def parse_serp(html=None, parser=None, scraper=None, search_engine=None, query='
     return serp
 
 
+_DOMAIN_URL_RE = re.compile(r'(?P<url>https?://[^\s]+)')
+
+
 def get_domain_if_present(domain_str):
     """Extracts the domain name. This functions assumed the extracted
     domain is valid. Under that assumption, it tries to slice out the
@@ -1352,7 +1548,10 @@ def get_domain_if_present(domain_str):
     irregularities in fucking Baidu search results).
 
     """
-    m = re.search("(?P<url>https?://[^\s]+)", domain_str)
+    # most strings handed in contain no url at all, those are rejected without the regex
+    if 'http' not in domain_str:
+        return None
+    m = _DOMAIN_URL_RE.search(domain_str)
     if m:
         return m.group("url")
 
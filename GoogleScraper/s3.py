@@ -1,22 +1,33 @@
 # -*- coding: utf-8 -*-
 
 import csv
-from io import BytesIO, StringIO
+from io import BytesIO, TextIOWrapper
 import json
+from operator import attrgetter
 import os
 from datetime import datetime
+from functools import lru_cache
+import logging
+import queue
+import threading
 
+import requests
 import tinys3
 
 
 SCRAPER_TO_LOAD = 'scraper_to_load'
 NULL_STRING='null_string'
+# How many threads upload the serp pages queued by store_serp_in_s3().
+UPLOAD_WORKERS = 8
+
+logger = logging.getLogger('GoogleScraper')
 
 
 class S3Table:
     
-    def __init__(self, table_obj, scrape_id, env, **switches):
+    def __init__(self, table_obj, scrape_id, env, conn=None, **switches):
         self._table_obj = table_obj
+        self._conn = conn or get_s3_conn(env)
         self._scrape_id = scrape_id
         self.AMAZON_WEB_SERVICES_ACCESS_KEY = env.get('AMAZON_WEB_SERVICES_ACCESS_KEY')
         self.AMAZON_WEB_SERVICES_SECRET_KEY = env.get('AMAZON_WEB_SERVICES_SECRET_KEY')
@@ -38,8 +49,10 @@ class S3Table:
             scrape_id=self._scrape_id,
             retry_tag=self.retry_tag)
         ##
-        self._buffer = StringIO()
-        self._writer = csv.writer(self._buffer,
+        # The rows are encoded as they are written, so the upload needs no second copy of the table.
+        self._buffer = BytesIO()
+        self._text = TextIOWrapper(self._buffer, encoding='utf-8', newline='')
+        self._writer = csv.writer(self._text,
                                   delimiter='\t')
 
 
@@ -51,18 +64,17 @@ class S3Table:
         
         
     def write_buffer_to_s3(self):
-        conn = tinys3.Connection(self.AMAZON_WEB_SERVICES_ACCESS_KEY,
-                                 self.AMAZON_WEB_SERVICES_SECRET_KEY)
-        content = BytesIO(self._buffer.getvalue().encode('utf-8'))
+        conn = self._conn
+        self._text.flush()
         conn.upload(os.path.join(SCRAPER_TO_LOAD, self._table_file),
-                    content,
+                    self._buffer,
                     self.RAVANA_S3_BUCKET)
         
-        manifest_content = BytesIO(StringIO(json.dumps(
+        manifest_content = BytesIO(json.dumps(
             {"entries": [{"url": "s3://{0}/{1}/{2}".format(
                 self.RAVANA_S3_BUCKET,
                 SCRAPER_TO_LOAD,
-                self._table_file)}]})).getvalue().encode('utf-8'))
+                self._table_file)}]}).encode('utf-8'))
         conn.upload(os.path.join(SCRAPER_TO_LOAD, self._manifest_file),
                     manifest_content,
                     self.RAVANA_S3_BUCKET)
@@ -71,25 +83,97 @@ class S3Table:
     def load_data(self, session):
         records = session.query(self._table_obj).all()
         #self._writer.writerow([ column.name for column in self._table_obj.__mapper__.columns ])
-        for rec in records:
-            self._writer.writerow([ self._None_to_string(getattr(rec, column.name))
-                                    for column in self._table_obj.__mapper__.columns ])
+        get_row = attrgetter(*[column.name for column in self._table_obj.__mapper__.columns])
+        none_to_string = self._None_to_string
+        self._writer.writerows([ none_to_string(value) for value in get_row(rec) ]
+                               for rec in records)
+
+
+# The keep-alive connections to S3. A requests.Session isn't guaranteed to be
+# thread safe, every thread that uploads (see UPLOAD_WORKERS) has its own.
+_sessions = threading.local()
+
+
+def _session():
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+
+class _Connection(tinys3.Connection):
+    """A tinys3 connection that sends its requests through the session of the thread.
+
+    tinys3 issues each request with the functions of the module returned by
+    S3Request.adapter(), a Session has the same interface. Both hooks are internals
+    of tinys3, which is pinned in requirements.txt for that reason.
+    """
+
+    def _handle_request(self, request):
+        request.adapter = _session
+        return super()._handle_request(request)
+
+
+@lru_cache(maxsize=None)
+def _connection(access_key, secret_key):
+    return _Connection(access_key, secret_key)
 
 
 def get_s3_conn(env):
-    return tinys3.Connection(env.get('AMAZON_WEB_SERVICES_ACCESS_KEY'),
-                             env.get('AMAZON_WEB_SERVICES_SECRET_KEY'))
+    """The connection for the keys in env. It is created once per process and shared."""
+    return _connection(env.get('AMAZON_WEB_SERVICES_ACCESS_KEY'),
+                       env.get('AMAZON_WEB_SERVICES_SECRET_KEY'))
+
+
+# The uploads queued by store_serp_in_s3(), worked off in the background.
+_upload_queue = queue.Queue()
+_upload_errors = []
+_upload_workers = []
+_upload_workers_lock = threading.Lock()
+
+
+def _upload_worker():
+    while True:
+        conn, key, content, bucket = _upload_queue.get()
+        try:
+            conn.upload(key, content, bucket)
+        except Exception as e:
+            logger.error('Uploading {} to S3 failed: {}'.format(key, e))
+            _upload_errors.append(e)
+        finally:
+            _upload_queue.task_done()
+
+
+def _start_upload_workers():
+    with _upload_workers_lock:
+        while len(_upload_workers) < UPLOAD_WORKERS:
+            worker = threading.Thread(target=_upload_worker, daemon=True)
+            worker.start()
+            _upload_workers.append(worker)
+
+
+def wait_for_uploads():
+    """Blocks until all queued serp uploads are done.
+
+    Raises:
+        The error of the first upload that failed since the last call.
+    """
+    _upload_queue.join()
+    if _upload_errors:
+        error = _upload_errors[0]
+        del _upload_errors[:]
+        raise error
 
 
 def store_serp_in_s3(serp, scrape_id, keyword, env, conn=None):
+    """Queues the upload of the serp page and returns right away, see wait_for_uploads()."""
     if not conn:
         conn = get_s3_conn(env)
-    content = BytesIO(serp.encode('utf-8'))
+    content = BytesIO(serp if isinstance(serp, bytes) else serp.encode('utf-8'))
     filename = "{scrape_id}_{keyword}_{time}.html".format(
         scrape_id=scrape_id,
         keyword=keyword,
         time=str(datetime.now()).replace(" ", "_"))
-    conn.upload(filename,
-                content,
-                env.get('L2WR_SERPS'))
+    _start_upload_workers()
+    _upload_queue.put((conn, filename, content, env.get('L2WR_SERPS')))
 